@@ -68,6 +68,10 @@ class RedisCache:
             CACHE_ERRORS_TOTAL.labels("redis", "set").inc()
 
 
+def weather_key(location: str) -> str:
+    return f"weather:{location.strip().lower()}"
+
+
 def serialize_item(item: CacheItem) -> str:
     return json.dumps({"payload": item.payload, "fetched_at": item.fetched_at})
 
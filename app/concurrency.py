@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import math
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from app.config import settings
+from app.metrics import CONCURRENCY_IN_FLIGHT, CONCURRENCY_LIMIT
+
+# Relative time budget in milliseconds, e.g. "X-Deadline-Ms: 800"
+DEADLINE_HEADER = "X-Deadline-Ms"
+
+
+def parse_deadline(value: str | None) -> Optional[float]:
+    # Returns an absolute time.monotonic() deadline, or None if absent/invalid.
+    # NaN, infinities and non-positive budgets are ignored.
+    if value is None or value.strip() == "":
+        return None
+    try:
+        ms = float(value)
+    except ValueError:
+        return None
+    if not math.isfinite(ms) or ms <= 0:
+        return None
+    return time.monotonic() + ms / 1000.0
+
+
+@dataclass
+class Permit:
+    started_at: float = field(default_factory=time.monotonic)
+    upstream: bool = False
+    # Cut short by the client's deadline: says nothing about congestion
+    deadline_exceeded: bool = False
+
+
+@dataclass
+class AdaptiveLimiter:
+    # AIMD: grow the limit by ~1 per limit's worth of fast completions,
+    # shrink it multiplicatively when latency exceeds the target.
+    limit: float = float(settings.CONCURRENCY_INITIAL_LIMIT)
+    min_limit: int = settings.CONCURRENCY_MIN_LIMIT
+    max_limit: int = settings.CONCURRENCY_MAX_LIMIT
+    latency_target: float = settings.CONCURRENCY_LATENCY_TARGET_SECONDS
+    backoff: float = settings.CONCURRENCY_BACKOFF
+    upstream_share: float = settings.CONCURRENCY_UPSTREAM_SHARE
+    upstream_half_life: float = settings.CONCURRENCY_UPSTREAM_LATENCY_HALF_LIFE_SECONDS
+    in_flight: int = 0
+    upstream_latency: float = 0.0
+    upstream_sampled_at: float = 0.0
+    last_decrease: float = 0.0
+
+    def __post_init__(self) -> None:
+        self.limit = float(min(max(self.limit, self.min_limit), self.max_limit))
+        CONCURRENCY_LIMIT.set(int(self.limit))
+
+    def saturated(self) -> bool:
+        return self.in_flight >= int(self.limit)
+
+    def try_acquire(self) -> Optional[Permit]:
+        if self.saturated():
+            return None
+        self.in_flight += 1
+        CONCURRENCY_IN_FLIGHT.set(self.in_flight)
+        return Permit()
+
+    def upstream_estimate(self, now: float | None = None) -> float:
+        # Smoothed upstream latency, decayed since the last sample. Requests shed
+        # on this estimate never produce samples, so without the decay one slow
+        # episode could keep shedding every deadline-bound request indefinitely.
+        if self.upstream_latency == 0.0:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        age = max(0.0, now - self.upstream_sampled_at)
+        return self.upstream_latency * 0.5 ** (age / self.upstream_half_life)
+
+    def _observe_upstream(self, latency: float, now: float) -> None:
+        current = self.upstream_estimate(now)
+        self.upstream_latency = latency if current == 0.0 else 0.8 * current + 0.2 * latency
+        self.upstream_sampled_at = now
+
+    def allow_upstream(self) -> bool:
+        # Caller already holds a permit. Upstream-bound work is only admitted
+        # below upstream_share of the limit so cache hits keep some headroom.
+        return self.in_flight <= max(1, int(self.limit * self.upstream_share))
+
+    def release(self, permit: Permit) -> None:
+        now = time.monotonic()
+        latency = now - permit.started_at
+        in_flight = self.in_flight
+        self.in_flight = max(0, self.in_flight - 1)
+        CONCURRENCY_IN_FLIGHT.set(self.in_flight)
+
+        if permit.deadline_exceeded:
+            # Elapsed time is a lower bound on upstream latency: fold it into the
+            # estimate like any other sample, but leave the limit alone.
+            self._observe_upstream(latency, now)
+            return
+
+        if permit.upstream:
+            self._observe_upstream(latency, now)
+
+        if latency > self.latency_target:
+            # At most one decrease per target interval, so a burst of slow
+            # completions from the same episode doesn't collapse the limit.
+            if now - self.last_decrease >= self.latency_target:
+                self.limit = max(float(self.min_limit), self.limit * self.backoff)
+                self.last_decrease = now
+        elif in_flight * 2 >= self.limit:
+            # Only grow when the limit is actually being used.
+            self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+        CONCURRENCY_LIMIT.set(int(self.limit))
@@ -37,5 +37,29 @@ class Settings:
     CIRCUIT_BREAKER_FAILS: int = _get_int("CIRCUIT_BREAKER_FAILS", 5)
     CIRCUIT_BREAKER_OPEN_SECONDS: int = _get_int("CIRCUIT_BREAKER_OPEN_SECONDS", 30)
 
+    # Adaptive concurrency limit for /weather (AIMD on observed latency)
+    CONCURRENCY_INITIAL_LIMIT: int = _get_int("CONCURRENCY_INITIAL_LIMIT", 20)
+    CONCURRENCY_MIN_LIMIT: int = _get_int("CONCURRENCY_MIN_LIMIT", 5)
+    CONCURRENCY_MAX_LIMIT: int = _get_int("CONCURRENCY_MAX_LIMIT", 200)
+    CONCURRENCY_LATENCY_TARGET_SECONDS: float = _get_float("CONCURRENCY_LATENCY_TARGET_SECONDS", 1.0)
+    CONCURRENCY_BACKOFF: float = _get_float("CONCURRENCY_BACKOFF", 0.9)
+    # Fraction of the limit upstream-bound requests may occupy; the rest is kept for cache hits
+    CONCURRENCY_UPSTREAM_SHARE: float = _get_float("CONCURRENCY_UPSTREAM_SHARE", 0.8)
+    # Upstream latency estimate used to shed requests whose deadline can't be met; halves
+    # every N seconds without new samples so a slow episode can't lock clients out of upstream
+    CONCURRENCY_UPSTREAM_LATENCY_HALF_LIFE_SECONDS: float = _get_float("CONCURRENCY_UPSTREAM_LATENCY_HALF_LIFE_SECONDS", 10.0)
+    SHED_RETRY_AFTER_SECONDS: int = _get_int("SHED_RETRY_AFTER_SECONDS", 1)
+
+    # Push stream (/stream/weather)
+    # Per-subscriber buffer; oldest updates are dropped when a slow client falls behind.
+    STREAM_QUEUE_SIZE: int = _get_int("STREAM_QUEUE_SIZE", 16)
+    STREAM_KEEPALIVE_SECONDS: float = _get_float("STREAM_KEEPALIVE_SECONDS", 15.0)
+    STREAM_MAX_LOCATIONS: int = _get_int("STREAM_MAX_LOCATIONS", 10)
+    STREAM_MAX_CONNECTIONS: int = _get_int("STREAM_MAX_CONNECTIONS", 500)
+    STREAM_REDIS_CHANNEL: str = os.getenv("STREAM_REDIS_CHANNEL", "weather:updates")
+    # Subscribed locations are refreshed once per CACHE_TTL_SECONDS by one pod (Redis SET NX lock)
+    STREAM_REFRESH_LOCK_SECONDS: int = _get_int("STREAM_REFRESH_LOCK_SECONDS", 10)
+    STREAM_REFRESH_RETRY_SECONDS: float = _get_float("STREAM_REFRESH_RETRY_SECONDS", 5.0)
+
 
 settings = Settings()
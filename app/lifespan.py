@@ -1,6 +1,9 @@
 from __future__ import annotations
 
 import asyncio
+import functools
+import signal
+import threading
 from dataclasses import dataclass
 from typing import Any, AsyncIterator, Optional
 
@@ -11,7 +14,10 @@ from fastapi import FastAPI
 from app.cache import MemoryCache, RedisCache
 from app.config import settings
 from app.circuit import CircuitBreaker
+from app.concurrency import AdaptiveLimiter
 from app.logging_utils import get_logger
+from app.stream import UpdateBroker
+from app.weather import refresh_subscribed
 
 log = get_logger(__name__)
 
@@ -23,14 +29,36 @@ class AppState:
     memory_cache: MemoryCache
     redis_client: Optional[redis.Redis]
     breaker: CircuitBreaker
+    limiter: AdaptiveLimiter
+    broker: UpdateBroker
     shutting_down: asyncio.Event
 
 
+def _install_shutdown_hook(on_shutdown) -> None:
+    # Uvicorn runs lifespan shutdown only after draining connections, so
+    # long-lived streams would hold the pod until the graceful timeout.
+    # Chain onto its SIGTERM/SIGINT handlers to signal shutdown before the drain.
+    if threading.current_thread() is not threading.main_thread():
+        return
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        previous = signal.getsignal(sig)
+        if not callable(previous):
+            continue
+
+        def handler(signum, frame, previous=previous):
+            loop.call_soon_threadsafe(on_shutdown)
+            previous(signum, frame)
+
+        signal.signal(sig, handler)
+
+
 async def lifespan(app: FastAPI) -> AsyncIterator[None]:
     shutting_down = asyncio.Event()
     http = httpx.AsyncClient()
     memory_cache = MemoryCache()
     breaker = CircuitBreaker()
+    limiter = AdaptiveLimiter()
 
     redis_client = None
     cache = memory_cache
@@ -45,16 +73,24 @@ async def lifespan(app: FastAPI) -> AsyncIterator[None]:
             redis_client = None
             cache = memory_cache
 
-    app.state.state = AppState(
+    broker = UpdateBroker(redis_client, cache=cache)
+
+    state = AppState(
         http=http,
         cache=cache,
         memory_cache=memory_cache,
         redis_client=redis_client,
         breaker=breaker,
+        limiter=limiter,
+        broker=broker,
         shutting_down=shutting_down,
     )
+    app.state.state = state
+    broker.start(functools.partial(refresh_subscribed, state))
+    _install_shutdown_hook(shutting_down.set)
     yield
     shutting_down.set()
+    await broker.stop()
     await http.aclose()
     if redis_client is not None:
         await redis_client.aclose()
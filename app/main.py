@@ -1,17 +1,21 @@
 from __future__ import annotations
 
+import asyncio
 import time
-from fastapi import FastAPI, HTTPException, Response, Request
+from fastapi import FastAPI, HTTPException, Query, Response, Request
+from fastapi.responses import StreamingResponse
 from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 
+from app.concurrency import DEADLINE_HEADER, Permit, parse_deadline
 from app.config import settings
 from app.correlation import correlation_id_middleware
 from app.logging_utils import configure_logging, get_logger
 from app.lifespan import lifespan
-from app.metrics import HTTP_REQUESTS_TOTAL, HTTP_REQUEST_DURATION, RATE_LIMITED_TOTAL, STALE_SERVED_TOTAL, CIRCUIT_OPEN_TOTAL
+from app.metrics import HTTP_REQUESTS_TOTAL, HTTP_REQUEST_DURATION, RATE_LIMITED_TOTAL, STALE_SERVED_TOTAL, CIRCUIT_OPEN_TOTAL, LOAD_SHED_TOTAL
 from app.rate_limit import _global_limiter
-from app.cache import CacheItem, serialize_item, deserialize_item
-from app.weather import fetch_weather, UpstreamError
+from app.cache import deserialize_item, weather_key
+from app.stream import event_stream
+from app.weather import refresh_weather, UpstreamError
 
 configure_logging()
 log = get_logger(__name__)
@@ -31,7 +35,12 @@ async def health(response: Response, request: Request):
     if st.shutting_down.is_set():
         response.status_code = 503
         return {"status": "shutting_down"}
-    return {"status": "ok"}
+    concurrency = {"in_flight": st.limiter.in_flight, "limit": int(st.limiter.limit)}
+    # Readiness: take the pod out of rotation while it is shedding load
+    if st.limiter.saturated():
+        response.status_code = 503
+        return {"status": "saturated", "concurrency": concurrency}
+    return {"status": "ok", "concurrency": concurrency}
 
 
 @app.get("/metrics")
@@ -39,6 +48,22 @@ async def metrics():
     return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 
+def _stale_payload(cached: str | None):
+    if cached:
+        item = deserialize_item(cached)
+        age = time.time() - item.fetched_at
+        if age <= settings.MAX_STALE_SECONDS:
+            STALE_SERVED_TOTAL.inc()
+            return item.payload
+    return None
+
+
+def _shed(reason: str, detail: str) -> HTTPException:
+    LOAD_SHED_TOTAL.labels(reason).inc()
+    headers = {"Retry-After": str(settings.SHED_RETRY_AFTER_SECONDS)} if reason != "deadline" else None
+    return HTTPException(status_code=503, detail=detail, headers=headers)
+
+
 @app.get("/weather/{location}")
 async def weather(location: str, request: Request):
     # Simple per-process fixed window rate limit
@@ -51,7 +76,21 @@ async def weather(location: str, request: Request):
     if not settings.OPENWEATHER_API_KEY:
         raise HTTPException(status_code=500, detail="OPENWEATHER_API_KEY not set")
 
-    key = f"weather:{location.strip().lower()}"
+    # Client-supplied budget; checked once the cache has had a chance to answer
+    deadline = parse_deadline(request.headers.get(DEADLINE_HEADER))
+
+    # Adaptive concurrency limit: shed early instead of queueing on the event loop
+    permit = st.limiter.try_acquire()
+    if permit is None:
+        raise _shed("overloaded", "overloaded")
+    try:
+        return await _weather(st, location, deadline, permit)
+    finally:
+        st.limiter.release(permit)
+
+
+async def _weather(st, location: str, deadline: float | None, permit: Permit):
+    key = weather_key(location)
 
     cached = await st.cache.get(key)
     if cached:
@@ -65,39 +104,78 @@ async def weather(location: str, request: Request):
     # Circuit breaker
     if st.breaker.is_open():
         CIRCUIT_OPEN_TOTAL.labels("openweather").inc()
-        if cached:
-            item = deserialize_item(cached)
-            age = time.time() - item.fetched_at
-            if age <= settings.MAX_STALE_SECONDS:
-                STALE_SERVED_TOTAL.inc()
-                return item.payload
+        stale = _stale_payload(cached)
+        if stale is not None:
+            return stale
         raise HTTPException(status_code=503, detail="upstream_circuit_open")
 
+    # Upstream-bound: don't start a fetch the client won't wait for (this also
+    # covers deadlines that have already passed)
+    timeout = None
+    if deadline is not None:
+        timeout = deadline - time.monotonic()
+        if timeout <= st.limiter.upstream_estimate():
+            stale = _stale_payload(cached)
+            if stale is not None:
+                return stale
+            raise _shed("deadline", "deadline_exceeded")
+
+    # Keep headroom for cache hits
+    if not st.limiter.allow_upstream():
+        stale = _stale_payload(cached)
+        if stale is not None:
+            return stale
+        raise _shed("upstream_saturated", "overloaded")
+
+    permit.upstream = True
     try:
-        payload = await fetch_weather(st.http, location)
-        st.breaker.record_success()
-        await st.cache.set(key, serialize_item(CacheItem(payload=payload, fetched_at=time.time())), settings.CACHE_TTL_SECONDS)
-        return payload
+        item = await asyncio.wait_for(refresh_weather(st, location), timeout)
+        return item.payload
+    except asyncio.TimeoutError:
+        # Client deadline hit; not an upstream failure or a congestion signal
+        permit.deadline_exceeded = True
+        stale = _stale_payload(cached)
+        if stale is not None:
+            return stale
+        raise HTTPException(status_code=503, detail="deadline_exceeded")
     except UpstreamError as e:
-        st.breaker.record_failure()
-        if cached:
-            item = deserialize_item(cached)
-            age = time.time() - item.fetched_at
-            if age <= settings.MAX_STALE_SECONDS:
-                STALE_SERVED_TOTAL.inc()
-                return item.payload
+        stale = _stale_payload(cached)
+        if stale is not None:
+            return stale
         raise HTTPException(status_code=503, detail="upstream_error")
     except Exception:
-        st.breaker.record_failure()
-        if cached:
-            item = deserialize_item(cached)
-            age = time.time() - item.fetched_at
-            if age <= settings.MAX_STALE_SECONDS:
-                STALE_SERVED_TOTAL.inc()
-                return item.payload
+        stale = _stale_payload(cached)
+        if stale is not None:
+            return stale
         raise HTTPException(status_code=503, detail="upstream_unavailable")
 
 
+@app.get("/stream/weather")
+async def stream_weather(request: Request, location: list[str] = Query(default=[])):
+    # Server-Sent Events: pushes an update whenever a subscribed location is refreshed
+    if not _global_limiter.allow():
+        RATE_LIMITED_TOTAL.labels("/stream/weather").inc()
+        raise HTTPException(status_code=429, detail="rate_limited")
+
+    keys = sorted({weather_key(loc) for loc in location if loc.strip()})
+    if not keys:
+        raise HTTPException(status_code=400, detail="location_required")
+    if len(keys) > settings.STREAM_MAX_LOCATIONS:
+        raise HTTPException(status_code=400, detail="too_many_locations")
+
+    st = request.app.state.state
+    if st.shutting_down.is_set():
+        raise HTTPException(status_code=503, detail="shutting_down")
+    if st.broker.connection_count() >= settings.STREAM_MAX_CONNECTIONS:
+        raise HTTPException(status_code=503, detail="too_many_streams", headers={"Retry-After": str(settings.SHED_RETRY_AFTER_SECONDS)})
+
+    return StreamingResponse(
+        event_stream(st.broker, st.cache, keys, st.shutting_down),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.middleware("http")
 async def prom_middleware(request: Request, call_next):
     start = time.time()
@@ -1,4 +1,4 @@
-from prometheus_client import Counter, Histogram
+from prometheus_client import Counter, Gauge, Histogram
 
 # HTTP server metrics (RED)
 HTTP_REQUESTS_TOTAL = Counter(
@@ -65,3 +65,47 @@ CIRCUIT_OPEN_TOTAL = Counter(
     "Number of times upstream circuit is open when request attempted",
     ["provider"],
 )
+
+# Adaptive concurrency / load shedding
+CONCURRENCY_LIMIT = Gauge(
+    "concurrency_limit",
+    "Current adaptive concurrency limit for /weather",
+)
+CONCURRENCY_IN_FLIGHT = Gauge(
+    "concurrency_in_flight",
+    "In-flight /weather requests",
+)
+LOAD_SHED_TOTAL = Counter(
+    "load_shed_requests_total",
+    "Requests shed before doing work",
+    ["reason"],  # overloaded|upstream_saturated|deadline
+)
+
+# Push stream
+STREAM_CONNECTIONS = Gauge(
+    "stream_connections",
+    "Open /stream/weather connections",
+)
+STREAM_SUBSCRIPTIONS = Gauge(
+    "stream_subscriptions",
+    "Active (connection, location) subscriptions",
+)
+STREAM_EVENTS_PUBLISHED_TOTAL = Counter(
+    "stream_events_published_total",
+    "Cache refresh events fanned out to local subscribers",
+    ["origin"],  # local|redis
+)
+STREAM_EVENTS_DROPPED_TOTAL = Counter(
+    "stream_events_dropped_total",
+    "Events dropped because a subscriber queue was full (slow consumer)",
+)
+STREAM_ERRORS_TOTAL = Counter(
+    "stream_errors_total",
+    "Errors in the push stream (Redis pub/sub, refresher)",
+    ["op"],  # publish|listen|decode|lock|refresh
+)
+STREAM_REFRESHES_TOTAL = Counter(
+    "stream_refreshes_total",
+    "Upstream refreshes run for subscribed locations",
+    ["result"],  # ok|error|rejected (upstream 400/404)|skipped (lock held elsewhere or circuit open)
+)
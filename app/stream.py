@@ -0,0 +1,288 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+import uuid
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable, Optional
+
+from app.cache import CacheItem, deserialize_item, serialize_item
+from app.config import settings
+from app.logging_utils import get_logger
+from app.metrics import (
+    STREAM_CONNECTIONS,
+    STREAM_ERRORS_TOTAL,
+    STREAM_EVENTS_DROPPED_TOTAL,
+    STREAM_EVENTS_PUBLISHED_TOTAL,
+    STREAM_REFRESHES_TOTAL,
+    STREAM_SUBSCRIPTIONS,
+)
+
+log = get_logger(__name__)
+
+RefreshFn = Callable[[str], Awaitable[Any]]
+
+
+class LocationRejected(Exception):
+    # Raised by the refresh callback when upstream rejects a location (e.g. 404);
+    # the broker stops refreshing it and tells its subscribers.
+    pass
+
+
+class Subscription:
+    def __init__(self, keys: Iterable[str], maxsize: int) -> None:
+        self.keys = frozenset(keys)
+        # (key, None) marks a location upstream rejected
+        self.queue: asyncio.Queue[tuple[str, Optional[CacheItem]]] = asyncio.Queue(maxsize=max(1, maxsize))
+
+    def offer(self, key: str, item: Optional[CacheItem]) -> None:
+        # Never block the publisher on a slow consumer: drop the oldest update instead.
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+                STREAM_EVENTS_DROPPED_TOTAL.inc()
+            except asyncio.QueueEmpty:
+                pass
+        self.queue.put_nowait((key, item))
+
+
+# Fans cache refreshes out to stream subscribers: locally in-process, and to
+# other pods through Redis pub/sub when a client is configured. While a key has
+# local subscribers the broker also keeps it refreshed, so streams don't depend
+# on /weather traffic.
+class UpdateBroker:
+    def __init__(
+        self,
+        redis_client=None,
+        queue_size: int | None = None,
+        channel: str | None = None,
+        cache: Any = None,
+    ) -> None:
+        self._r = redis_client
+        self._cache = cache
+        self._queue_size = queue_size if queue_size is not None else settings.STREAM_QUEUE_SIZE
+        self._channel = channel or settings.STREAM_REDIS_CHANNEL
+        self._origin = uuid.uuid4().hex
+        self._subs: dict[str, set[Subscription]] = {}
+        self._connections = 0
+        self._listener: Optional[asyncio.Task[None]] = None
+        self._refresh: Optional[RefreshFn] = None
+        self._refreshers: dict[str, asyncio.Task[None]] = {}
+
+    def subscribe(self, keys: Iterable[str]) -> Subscription:
+        sub = Subscription(keys, self._queue_size)
+        for key in sub.keys:
+            self._subs.setdefault(key, set()).add(sub)
+            if self._refresh is not None and self._cache is not None and key not in self._refreshers:
+                self._refreshers[key] = asyncio.create_task(self._refresh_loop(key))
+        self._connections += 1
+        STREAM_SUBSCRIPTIONS.inc(len(sub.keys))
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        for key in sub.keys:
+            subs = self._subs.get(key)
+            if subs is None:
+                continue
+            subs.discard(sub)
+            if not subs:
+                self._subs.pop(key, None)
+                task = self._refreshers.pop(key, None)
+                if task is not None:
+                    task.cancel()
+        self._connections -= 1
+        STREAM_SUBSCRIPTIONS.dec(len(sub.keys))
+
+    @property
+    def origin(self) -> str:
+        return self._origin
+
+    def connection_count(self) -> int:
+        return self._connections
+
+    def subscriber_count(self, key: str) -> int:
+        return len(self._subs.get(key, ()))
+
+    def refreshing(self, key: str) -> bool:
+        return key in self._refreshers
+
+    def _fan_out(self, key: str, item: CacheItem, origin: str) -> int:
+        subs = self._subs.get(key)
+        if not subs:
+            return 0
+        for sub in list(subs):
+            sub.offer(key, item)
+        STREAM_EVENTS_PUBLISHED_TOTAL.labels(origin).inc()
+        return len(subs)
+
+    async def publish(self, key: str, item: CacheItem) -> None:
+        self._fan_out(key, item, "local")
+        if self._r is None:
+            return
+        msg = json.dumps({"origin": self._origin, "key": key, "item": serialize_item(item)})
+        try:
+            await self._r.publish(self._channel, msg)
+        except Exception:
+            STREAM_ERRORS_TOTAL.labels("publish").inc()
+            log.warning("stream_publish_failed")
+
+    def start(self, refresh: Optional[RefreshFn] = None) -> None:
+        # refresh(location) fetches upstream, writes the cache and publishes;
+        # it returns None when it decided not to fetch.
+        self._refresh = refresh
+        if self._r is not None and self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        tasks = list(self._refreshers.values())
+        self._refreshers.clear()
+        if self._listener is not None:
+            tasks.append(self._listener)
+            self._listener = None
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def _refresh_due_in(self, key: str) -> float:
+        cached = await self._cache.get(key)
+        if not cached:
+            return 0.0
+        age = time.time() - deserialize_item(cached).fetched_at
+        return max(0.0, settings.CACHE_TTL_SECONDS - age)
+
+    async def _acquire_refresh_lock(self, key: str) -> bool:
+        # One pod refreshes each key; the others get the update via pub/sub.
+        if self._r is None:
+            return True
+        try:
+            return bool(await self._r.set(f"{key}:refresh_lock", self._origin, nx=True, ex=settings.STREAM_REFRESH_LOCK_SECONDS))
+        except Exception:
+            STREAM_ERRORS_TOTAL.labels("lock").inc()
+            return True
+
+    async def _refresh_loop(self, key: str) -> None:
+        location = key.split(":", 1)[1]
+        while True:
+            try:
+                due_in = await self._refresh_due_in(key)
+                if due_in > 0:
+                    await asyncio.sleep(due_in)
+                    continue
+                if await self._acquire_refresh_lock(key) and await self._refresh(location) is not None:
+                    STREAM_REFRESHES_TOTAL.labels("ok").inc()
+                    await asyncio.sleep(settings.CACHE_TTL_SECONDS)
+                    continue
+                # Another pod holds the lock, or the refresh was skipped (e.g. circuit open)
+                STREAM_REFRESHES_TOTAL.labels("skipped").inc()
+            except asyncio.CancelledError:
+                raise
+            except LocationRejected:
+                STREAM_REFRESHES_TOTAL.labels("rejected").inc()
+                log.info("stream_location_rejected", location=location)
+                self._refreshers.pop(key, None)
+                for sub in list(self._subs.get(key, ())):
+                    sub.offer(key, None)
+                return
+            except Exception:
+                STREAM_REFRESHES_TOTAL.labels("error").inc()
+                STREAM_ERRORS_TOTAL.labels("refresh").inc()
+                log.warning("stream_refresh_failed", location=location)
+            await asyncio.sleep(settings.STREAM_REFRESH_RETRY_SECONDS)
+
+    def _handle_message(self, data: Any) -> None:
+        try:
+            if isinstance(data, (bytes, bytearray)):
+                data = data.decode("utf-8")
+            obj = json.loads(data)
+            # Our own refreshes were already delivered locally in publish().
+            if obj.get("origin") == self._origin:
+                return
+            key, item = obj["key"], deserialize_item(obj["item"])
+        except Exception:
+            STREAM_ERRORS_TOTAL.labels("decode").inc()
+            return
+        self._fan_out(key, item, "redis")
+
+    async def _listen(self) -> None:
+        while True:
+            pubsub = self._r.pubsub()
+            try:
+                await pubsub.subscribe(self._channel)
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self._handle_message(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                STREAM_ERRORS_TOTAL.labels("listen").inc()
+                log.warning("stream_listener_failed")
+                await asyncio.sleep(1.0)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+
+def format_event(key: str, item: CacheItem) -> str:
+    location = key.split(":", 1)[1]
+    data = json.dumps({"location": location, "payload": item.payload, "fetched_at": item.fetched_at})
+    return f"event: update\ndata: {data}\n\n"
+
+
+def format_rejected(key: str) -> str:
+    location = key.split(":", 1)[1]
+    data = json.dumps({"location": location, "error": "location_rejected"})
+    return f"event: error\ndata: {data}\n\n"
+
+
+async def event_stream(
+    broker: UpdateBroker,
+    cache: Any,
+    keys: list[str],
+    shutting_down: asyncio.Event,
+) -> AsyncIterator[str]:
+    # Subscribe before reading the snapshot so a refresh in between is not lost.
+    sub = broker.subscribe(keys)
+    STREAM_CONNECTIONS.inc()
+    stop: Optional[asyncio.Future[Any]] = None
+    get: Optional[asyncio.Future[Any]] = None
+    try:
+        # Tell EventSource clients to reconnect quickly if the pod goes away.
+        yield "retry: 3000\n\n"
+        for key in sub.keys:
+            cached = await cache.get(key)
+            if cached:
+                yield format_event(key, deserialize_item(cached))
+        # Wait on the queue and the shutdown event together so a rollout
+        # ends open streams right away instead of at the next keepalive.
+        stop = asyncio.ensure_future(shutting_down.wait())
+        rejected: set[str] = set()
+        while not shutting_down.is_set():
+            get = asyncio.ensure_future(sub.queue.get())
+            await asyncio.wait({get, stop}, timeout=settings.STREAM_KEEPALIVE_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+            if not get.done():
+                get.cancel()
+                if not stop.done():
+                    yield ": keepalive\n\n"
+                continue
+            key, item = get.result()
+            if item is not None:
+                yield format_event(key, item)
+                continue
+            yield format_rejected(key)
+            rejected.add(key)
+            # Nothing left to stream once upstream has rejected every location
+            if rejected >= sub.keys:
+                return
+    finally:
+        if stop is not None:
+            stop.cancel()
+        if get is not None:
+            get.cancel()
+        STREAM_CONNECTIONS.dec()
+        broker.unsubscribe(sub)
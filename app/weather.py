@@ -6,6 +6,7 @@ from typing import Any
 import httpx
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception
 
+from app.cache import CacheItem, serialize_item, weather_key
 from app.config import settings
 from app.correlation import get_request_id
 from app.metrics import (
@@ -13,6 +14,7 @@ from app.metrics import (
     UPSTREAM_REQUEST_DURATION,
     UPSTREAM_REQUESTS_TOTAL,
 )
+from app.stream import LocationRejected
 
 
 class UpstreamError(Exception):
@@ -70,3 +72,38 @@ async def fetch_weather(http: httpx.AsyncClient, location: str) -> dict[str, Any
         "humidity": data.get("main", {}).get("humidity"),
         "wind_speed": data.get("wind", {}).get("speed"),
     }
+
+
+def _is_client_error(exc: Exception) -> bool:
+    # Non-retryable 4xx: the request was bad, upstream is fine
+    return isinstance(exc, UpstreamError) and exc.status_code is not None and 400 <= exc.status_code < 500 and exc.status_code != 429
+
+
+async def refresh_weather(st: Any, location: str) -> CacheItem:
+    # Shared refresh path for /weather and the stream refresher:
+    # fetch, update the breaker, write the cache and publish to subscribers.
+    try:
+        payload = await fetch_weather(st.http, location)
+    except Exception as e:
+        # An unknown city must not open the breaker for everyone else
+        if not _is_client_error(e):
+            st.breaker.record_failure()
+        raise
+    st.breaker.record_success()
+    key = weather_key(location)
+    item = CacheItem(payload=payload, fetched_at=time.time())
+    await st.cache.set(key, serialize_item(item), settings.CACHE_TTL_SECONDS)
+    await st.broker.publish(key, item)
+    return item
+
+
+async def refresh_subscribed(st: Any, location: str) -> CacheItem | None:
+    # Refresh callback for UpdateBroker; None means nothing was fetched.
+    if not settings.OPENWEATHER_API_KEY or st.breaker.is_open():
+        return None
+    try:
+        return await refresh_weather(st, location)
+    except UpstreamError as e:
+        if e.status_code in (400, 404):
+            raise LocationRejected(location) from e
+        raise
@@ -0,0 +1,87 @@
+import time
+
+from app.concurrency import AdaptiveLimiter, parse_deadline
+
+
+def _limiter(**kw):
+    args = dict(limit=4, min_limit=2, max_limit=10, latency_target=0.5, backoff=0.5, upstream_share=0.5)
+    args.update(kw)
+    return AdaptiveLimiter(**args)
+
+
+def test_sheds_when_limit_reached():
+    lim = _limiter()
+    permits = [lim.try_acquire() for _ in range(4)]
+    assert all(p is not None for p in permits)
+    assert lim.saturated()
+    assert lim.try_acquire() is None
+
+    lim.release(permits[0])
+    assert not lim.saturated()
+    assert lim.try_acquire() is not None
+
+
+def test_upstream_admission_leaves_headroom_for_cache():
+    lim = _limiter()
+    lim.try_acquire()
+    lim.try_acquire()
+    assert lim.allow_upstream()
+    lim.try_acquire()
+    assert not lim.allow_upstream()
+
+
+def test_aimd_grows_on_fast_and_shrinks_on_slow():
+    lim = _limiter()
+    held = [lim.try_acquire() for _ in range(3)]
+    lim.release(held.pop())
+    assert lim.limit > 4
+
+    slow = held.pop()
+    slow.started_at = time.monotonic() - 1.0
+    before = lim.limit
+    lim.release(slow)
+    assert lim.limit == before * 0.5
+
+    # Repeated slow completions within the same interval don't keep shrinking
+    slow = held.pop()
+    slow.started_at = time.monotonic() - 1.0
+    lim.release(slow)
+    assert lim.limit == before * 0.5
+
+
+def test_parse_deadline():
+    assert parse_deadline(None) is None
+    assert parse_deadline("nope") is None
+    d = parse_deadline("500")
+    assert 0.4 < d - time.monotonic() <= 0.5
+
+
+def test_parse_deadline_rejects_non_finite_and_non_positive():
+    for value in ("nan", "NaN", "inf", "-inf", "0", "-5"):
+        assert parse_deadline(value) is None
+
+
+def test_deadline_timeout_does_not_shrink_limit():
+    lim = _limiter()
+    permit = lim.try_acquire()
+    permit.upstream = True
+    permit.deadline_exceeded = True
+    permit.started_at = time.monotonic() - 1.0
+    lim.release(permit)
+
+    assert lim.limit == 4
+    assert lim.upstream_estimate() >= 0.99
+
+
+def test_upstream_estimate_decays_without_samples():
+    lim = _limiter(upstream_half_life=1.0)
+    permit = lim.try_acquire()
+    permit.upstream = True
+    permit.deadline_exceeded = True
+    permit.started_at = time.monotonic() - 0.4
+    lim.release(permit)
+
+    now = lim.upstream_sampled_at
+    assert abs(lim.upstream_estimate(now) - 0.4) < 0.01
+    assert abs(lim.upstream_estimate(now + 1.0) - 0.2) < 0.01
+    assert lim.upstream_estimate(now + 10.0) < 0.001
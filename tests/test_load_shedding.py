@@ -0,0 +1,134 @@
+import asyncio
+import time
+
+import pytest
+import respx
+from httpx import Response
+from fastapi.testclient import TestClient
+
+import app.main as main
+from app.cache import CacheItem, serialize_item
+from app.concurrency import AdaptiveLimiter
+from app.config import settings
+from app.main import app
+from app.rate_limit import _global_limiter
+
+
+@pytest.fixture(autouse=True)
+def _set_key(monkeypatch):
+    monkeypatch.setattr(settings, 'OPENWEATHER_API_KEY', 'testkey')
+    monkeypatch.setattr(_global_limiter, 'limit', 10**6)
+
+
+@pytest.fixture
+def client():
+    with TestClient(app) as c:
+        yield c
+
+
+def _state():
+    return app.state.state
+
+
+def _small_limiter(**kw):
+    args = dict(limit=4, min_limit=1, max_limit=10, latency_target=10.0, upstream_share=0.25)
+    args.update(kw)
+    return AdaptiveLimiter(**args)
+
+
+def _put(key, age):
+    item = CacheItem(payload={'temperature': 1.0}, fetched_at=time.time() - age)
+    _state().memory_cache._store[key] = (time.time() + 60, serialize_item(item))
+
+
+def test_overloaded_returns_503_with_retry_after(client):
+    st = _state()
+    st.limiter = _small_limiter()
+    while st.limiter.try_acquire() is not None:
+        pass
+
+    r = client.get('/weather/seattle')
+    assert r.status_code == 503
+    assert r.json()['detail'] == 'overloaded'
+    assert r.headers['Retry-After'] == str(settings.SHED_RETRY_AFTER_SECONDS)
+
+
+@respx.mock
+def test_upstream_shed_serves_stale_cache(client):
+    route = respx.get(settings.OPENWEATHER_URL).mock(return_value=Response(500))
+    st = _state()
+    st.limiter = _small_limiter()
+    st.limiter.try_acquire()  # request's own permit pushes in_flight past the upstream share
+    _put('weather:oslo', settings.CACHE_TTL_SECONDS + 10)
+
+    r = client.get('/weather/oslo')
+    assert r.status_code == 200
+    assert r.json() == {'temperature': 1.0}
+    assert not route.called
+
+
+def test_expired_deadline_returns_503(client, monkeypatch):
+    monkeypatch.setattr(main, 'parse_deadline', lambda value: time.monotonic() - 1.0)
+
+    r = client.get('/weather/nowhere', headers={'X-Deadline-Ms': '1'})
+    assert r.status_code == 503
+    assert r.json()['detail'] == 'deadline_exceeded'
+    assert 'Retry-After' not in r.headers
+
+
+def test_expired_deadline_still_served_from_fresh_cache(client, monkeypatch):
+    monkeypatch.setattr(main, 'parse_deadline', lambda value: time.monotonic() - 1.0)
+    _put('weather:paris', 0)
+
+    r = client.get('/weather/paris', headers={'X-Deadline-Ms': '1'})
+    assert r.status_code == 200
+    assert r.json() == {'temperature': 1.0}
+
+
+def test_health_reports_saturation(client):
+    st = _state()
+    st.limiter = _small_limiter(limit=2)
+    st.limiter.try_acquire()
+    st.limiter.try_acquire()
+
+    r = client.get('/health')
+    assert r.status_code == 503
+    assert r.json() == {'status': 'saturated', 'concurrency': {'in_flight': 2, 'limit': 2}}
+
+
+@respx.mock
+def test_deadline_timeout_sheds_then_recovers(client):
+    slow = {'on': True}
+    calls = []
+
+    async def upstream(request):
+        # Counted here: respx doesn't record calls cancelled mid-flight
+        calls.append(request)
+        if slow['on']:
+            await asyncio.sleep(0.3)
+        return Response(200, json={'main': {'temp': 2.0}})
+
+    respx.get(settings.OPENWEATHER_URL).mock(side_effect=upstream)
+    st = _state()
+    st.limiter = _small_limiter(upstream_share=1.0, upstream_half_life=0.05)
+
+    # Slow upstream: the fetch is cancelled at the client's deadline
+    r = client.get('/weather/bergen', headers={'X-Deadline-Ms': '200'})
+    assert r.status_code == 503
+    assert r.json()['detail'] == 'deadline_exceeded'
+    assert len(calls) == 1
+    assert st.limiter.limit == 4
+
+    # A tighter budget than observed upstream latency is shed without a fetch
+    r = client.get('/weather/bergen', headers={'X-Deadline-Ms': '100'})
+    assert r.status_code == 503
+    assert r.json()['detail'] == 'deadline_exceeded'
+    assert len(calls) == 1
+
+    # Upstream recovers; the estimate decays and the same budget reaches upstream again
+    slow['on'] = False
+    time.sleep(0.4)
+    r = client.get('/weather/bergen', headers={'X-Deadline-Ms': '100'})
+    assert r.status_code == 200
+    assert r.json()['temperature'] == 2.0
+    assert len(calls) == 2
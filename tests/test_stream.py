@@ -0,0 +1,237 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+import respx
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from app.cache import CacheItem, MemoryCache, serialize_item, weather_key
+from app.circuit import CircuitBreaker
+from app.config import settings
+from app.main import app
+from app.rate_limit import _global_limiter
+from app.stream import UpdateBroker, event_stream
+from app.weather import refresh_subscribed
+
+
+@pytest.mark.asyncio
+async def test_publish_fans_out_to_subscribers():
+    broker = UpdateBroker(queue_size=4)
+    a = broker.subscribe([weather_key("Seattle")])
+    b = broker.subscribe([weather_key("seattle"), weather_key("london")])
+
+    item = CacheItem(payload={"temperature": 10.0}, fetched_at=1.0)
+    await broker.publish(weather_key("seattle"), item)
+
+    assert a.queue.get_nowait() == ("weather:seattle", item)
+    assert b.queue.get_nowait() == ("weather:seattle", item)
+
+    broker.unsubscribe(a)
+    await broker.publish(weather_key("seattle"), item)
+    assert a.queue.empty()
+    assert b.queue.qsize() == 1
+
+
+@pytest.mark.asyncio
+async def test_slow_subscriber_keeps_latest_updates():
+    broker = UpdateBroker(queue_size=2)
+    sub = broker.subscribe(["weather:oslo"])
+    for i in range(5):
+        await broker.publish("weather:oslo", CacheItem(payload={"n": i}, fetched_at=float(i)))
+
+    assert [sub.queue.get_nowait()[1].payload["n"] for _ in range(2)] == [3, 4]
+
+
+@pytest.mark.asyncio
+async def test_event_stream_sends_snapshot_then_updates():
+    broker = UpdateBroker()
+    cache = MemoryCache()
+    await cache.set("weather:paris", serialize_item(CacheItem(payload={"n": 0}, fetched_at=0.0)), 60)
+
+    stream = event_stream(broker, cache, ["weather:paris"], asyncio.Event())
+    assert (await stream.__anext__()).startswith("retry:")
+    assert '"n": 0' in await stream.__anext__()
+
+    next_chunk = asyncio.ensure_future(stream.__anext__())
+    await asyncio.sleep(0)
+    await broker.publish("weather:paris", CacheItem(payload={"n": 1}, fetched_at=1.0))
+    chunk = await next_chunk
+    assert chunk.startswith("event: update")
+    assert '"location": "paris"' in chunk
+    assert '"n": 1' in chunk
+    await stream.aclose()
+
+
+@pytest.mark.asyncio
+async def test_subscribed_key_is_refreshed_without_weather_traffic():
+    cache = MemoryCache()
+    broker = UpdateBroker(cache=cache)
+    calls = []
+
+    async def refresh(location):
+        calls.append(location)
+        item = CacheItem(payload={"temperature": 5.0}, fetched_at=time.time())
+        await cache.set(weather_key(location), serialize_item(item), 60)
+        await broker.publish(weather_key(location), item)
+        return item
+
+    broker.start(refresh)
+    sub = broker.subscribe([weather_key("Berlin")])
+    try:
+        key, item = await asyncio.wait_for(sub.queue.get(), timeout=1.0)
+        assert key == "weather:berlin"
+        assert item.payload == {"temperature": 5.0}
+        assert calls == ["berlin"]
+    finally:
+        broker.unsubscribe(sub)
+        await broker.stop()
+
+
+class _IdlePubSub:
+    async def subscribe(self, *args):
+        pass
+
+    async def listen(self):
+        await asyncio.Event().wait()
+        yield
+
+    async def aclose(self):
+        pass
+
+
+class _LockHeldRedis:
+    async def set(self, *args, **kwargs):
+        return None
+
+    async def publish(self, *args, **kwargs):
+        return 0
+
+    def pubsub(self):
+        return _IdlePubSub()
+
+
+@pytest.mark.asyncio
+async def test_refresh_skipped_when_another_pod_holds_lock():
+    broker = UpdateBroker(redis_client=_LockHeldRedis(), cache=MemoryCache())
+    calls = []
+
+    async def refresh(location):
+        calls.append(location)
+
+    broker.start(refresh)
+    sub = broker.subscribe(["weather:rome"])
+    assert broker.refreshing("weather:rome")
+    await asyncio.sleep(0.05)
+    assert calls == []
+    broker.unsubscribe(sub)
+    assert not broker.refreshing("weather:rome")
+    await broker.stop()
+
+
+def _subscriptions():
+    return REGISTRY.get_sample_value("stream_subscriptions")
+
+
+@pytest.mark.asyncio
+async def test_event_stream_exits_when_shutting_down():
+    broker = UpdateBroker()
+    shutting_down = asyncio.Event()
+    before = _subscriptions()
+    stream = event_stream(broker, MemoryCache(), ["weather:lima"], shutting_down)
+    assert (await stream.__anext__()).startswith("retry:")
+    assert broker.subscriber_count("weather:lima") == 1
+    assert _subscriptions() == before + 1
+
+    next_chunk = asyncio.ensure_future(stream.__anext__())
+    await asyncio.sleep(0)
+    shutting_down.set()
+    with pytest.raises(StopAsyncIteration):
+        await asyncio.wait_for(next_chunk, timeout=1.0)
+    assert broker.subscriber_count("weather:lima") == 0
+    assert broker.connection_count() == 0
+    assert _subscriptions() == before
+
+
+def _decode_errors():
+    return REGISTRY.get_sample_value("stream_errors_total", {"op": "decode"}) or 0.0
+
+
+@pytest.mark.asyncio
+async def test_handle_message_fans_out_other_pods_only():
+    broker = UpdateBroker()
+    sub = broker.subscribe(["weather:tokyo"])
+    item = CacheItem(payload={"n": 1}, fetched_at=1.0)
+
+    own = json.dumps({"origin": broker.origin, "key": "weather:tokyo", "item": serialize_item(item)})
+    broker._handle_message(own.encode())
+    assert sub.queue.empty()
+
+    other = json.dumps({"origin": "other-pod", "key": "weather:tokyo", "item": serialize_item(item)})
+    broker._handle_message(other.encode())
+    assert sub.queue.get_nowait() == ("weather:tokyo", item)
+
+    before = _decode_errors()
+    broker._handle_message(b"not json")
+    broker._handle_message(json.dumps({"origin": "other-pod"}))
+    assert _decode_errors() == before + 2
+    assert sub.queue.empty()
+
+
+def test_stream_requires_location():
+    with TestClient(app) as client:
+        r = client.get("/stream/weather")
+        assert r.status_code == 400
+        assert r.json()["detail"] == "location_required"
+
+
+def test_stream_rejects_too_many_locations(monkeypatch):
+    monkeypatch.setattr(settings, "STREAM_MAX_LOCATIONS", 2)
+    with TestClient(app) as client:
+        r = client.get("/stream/weather", params={"location": ["a", "b", "c"]})
+        assert r.status_code == 400
+        assert r.json()["detail"] == "too_many_locations"
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_invalid_locations_do_not_open_breaker(monkeypatch):
+    monkeypatch.setattr(settings, "OPENWEATHER_API_KEY", "testkey")
+    route = respx.get(settings.OPENWEATHER_URL).mock(return_value=httpx.Response(404, json={"message": "city not found"}))
+    cache = MemoryCache()
+    broker = UpdateBroker(cache=cache)
+    async with httpx.AsyncClient() as http:
+        st = SimpleNamespace(http=http, cache=cache, broker=broker, breaker=CircuitBreaker())
+        broker.start(lambda location: refresh_subscribed(st, location))
+
+        keys = [weather_key(f"nowhere-{i}") for i in range(settings.CIRCUIT_BREAKER_FAILS)]
+        stream = event_stream(broker, cache, keys, asyncio.Event())
+        chunks = [chunk async for chunk in stream]
+
+    assert route.call_count == len(keys)
+    assert st.breaker.failures == 0
+    assert not st.breaker.is_open()
+    # Every location was rejected once, then the stream ended
+    assert sum(c.startswith("event: error") for c in chunks) == len(keys)
+    assert all(not broker.refreshing(k) for k in keys)
+    assert broker.connection_count() == 0
+    await broker.stop()
+
+
+def test_stream_is_rate_limited(monkeypatch):
+    monkeypatch.setattr(_global_limiter, "limit", 0)
+    with TestClient(app) as client:
+        r = client.get("/stream/weather", params={"location": "oslo"})
+        assert r.status_code == 429
+
+
+def test_stream_connection_cap(monkeypatch):
+    monkeypatch.setattr(settings, "STREAM_MAX_CONNECTIONS", 0)
+    with TestClient(app) as client:
+        r = client.get("/stream/weather", params={"location": "oslo"})
+        assert r.status_code == 503
+        assert r.json()["detail"] == "too_many_streams"
+        assert "Retry-After" in r.headers